@@ -13,6 +13,7 @@ Brief list of the classes:
 FoodType:       -- Enum type for food items, describes the units
 FoodItem:       -- Data structure for a food item. Contains amount, type, unit and expiry
 FoodList:       -- List of food items and useful functions
+SQLiteFoodList: -- FoodList stored in a local SQLite database
 RecipeItem:     -- Structure for recipes, contains a name and a FoodList
 RecipeBuilder:  -- Contains current fridge and recipes, and functions to sort and search 
 
@@ -23,6 +24,8 @@ format expected in the CSV file is: [name],[amount],[type],[date]. e.g.
 
             cheese,10,slices,26/12/2014
 
+The date can be left off for food that never goes off.
+
 The recipe file is assumed to be a JSON string containing recipe objects 
 with a name and a list of ingredients. e.g.
             [ {
@@ -43,7 +46,13 @@ import csv
 import json
 import datetime
 import itertools
+import collections
+import heapq
 import os
+import sqlite3
+import contextlib
+import tempfile
+import shutil
 import unittest
 
 # enum of food types...
@@ -66,7 +75,7 @@ class FoodType:
 class FoodItem(object):
     """ 
         FoodItem contains an amount, a type, a name and an 
-        expiry if required.
+        expiry if required. Food with no expiry never goes off.
     """
     def __init__(self, amt=0, food_type=FoodType.SINGLE, name='', date=None):
         self.amount = amt
@@ -84,6 +93,12 @@ class FoodItem(object):
                 (self.name == other.name) and \
                 (self.expiry == other.expiry) \
 
+    def edible(self, date):
+        return self.expiry is None or self.expiry >= date
+    def expiry_key(self):
+        # soonest first, with food that never goes off last...
+        return (self.expiry is None, self.expiry)
+
 class FoodList(object):
     """
         Full food list object. Used for unpacking the strings and 
@@ -107,6 +122,30 @@ class FoodList(object):
     def __len__(self):
         return len(self.items)
 
+    def add_items(self, items, clear=False):
+        """
+            Adds a list of already parsed FoodItems to the list. If
+            clear is set, the existing contents are replaced...
+        """
+        if clear:
+            self.items = []
+        self.items.extend(items)
+
+    def read_csv(self, filename):
+        """
+            Adds the items from a fridge CSV file. Lines that can't
+            be parsed, including blank or short ones, are skipped.
+            Failing to open the file raises...
+        """
+        with open(filename, 'rb') as f:
+            for line in csv.reader(f, delimiter=','):
+                # [name],[amount],[type] and an optional [date]...
+                if len(line) not in (3, 4):
+                    print "Failed to parse fridge line: {}".format(','.join(line))
+                    continue
+                # unpack the string and add to the fridge data structure...
+                self.build_fridge_item(*line)
+
     def build_fridge_item(self, name, amt, food_type, expiry=None):
         """
             This function is used to pull in string arguments,
@@ -141,33 +180,186 @@ class FoodList(object):
     def _compact_food_list(self, food):
         """
             We use the groupby function to combine similar items.
-            Firstly groupby needs names in contiguous positions...
+            Firstly groupby needs names and types in contiguous
+            positions, otherwise a name with mixed types would be
+            split into several runs of the same type...
         """
-        food = sorted(food, key=lambda x: x.name)
-        # we group by name, but not by type...
+        food = sorted(food, key=lambda x: (x.name, x.type))
+        # we group by name and type...
         grouped_list = itertools.groupby(food, key=lambda x: x.name + x.type)
         all_list = FoodList()
         for key, x in grouped_list:
             same_foods = list(x)
+            # build a new item rather than summing into the fridge's own...
             item = same_foods[0]
-            item.amount = sum(y.amount for y in same_foods)
-            all_list.items.append(item)
+            all_list.items.append(FoodItem(sum(y.amount for y in same_foods),
+                                           item.type, item.name, item.expiry))
         return all_list
 
-    def todays_food(self):
+    def todays_food(self, date=None):
         """
             Here we simply need to sort on the expiry, and drop 
             anything that is past the expiry. We then combine the
-            remaining food to get today's available food...
+            remaining food to get today's available food. The date
+            defaults to today...
         """
+        if date is None:
+            date = datetime.date.today()
         # print out items in fridge in expiry order...
-        sorted_food = sorted(self.items, key=lambda x: x.expiry)
-        edible = filter(lambda x: x.expiry >= datetime.date.today(), sorted_food)
+        sorted_food = sorted(self.items, key=FoodItem.expiry_key)
+        edible = filter(lambda x: x.edible(date), sorted_food)
         # don't care about expiry any more, we're good. Now we can combine the items
         # for our final list...
         food = self._compact_food_list(edible)
         return food
 
+class SQLiteFoodList(FoodList):
+    """
+        FoodList backed by a local SQLite database rather than an
+        in-memory list. Items are indexed on (name, unit) and on
+        expiry, so adding or consuming an item is a single indexed
+        write and today's food is an indexed query. Every operation
+        opens its own connection, so the list can be shared between
+        server threads and processes...
+    """
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS fridge (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                amount INTEGER NOT NULL,
+                expiry DATE)""",
+        "CREATE INDEX IF NOT EXISTS fridge_name_unit ON fridge (name, unit)",
+        "CREATE INDEX IF NOT EXISTS fridge_expiry ON fridge (expiry)",
+    ]
+
+    def __init__(self, filename):
+        self.filename = filename
+        with self._transaction() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        # WAL lets readers carry on while an upload is written...
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.filename, timeout=10,
+                               isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+        conn.text_factory = str
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """
+            Opens a connection and holds the write lock for the
+            duration of the block, rolling back on any error...
+        """
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _query(self, sql, args=()):
+        with contextlib.closing(self._connect()) as conn:
+            return conn.execute(sql, args).fetchall()
+
+    @property
+    def items(self):
+        rows = self._query('SELECT amount, unit, name, expiry FROM fridge ORDER BY id')
+        return [FoodItem(*row) for row in rows]
+
+    @items.setter
+    def items(self, items):
+        self.add_items(items, clear=True)
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM fridge')[0][0]
+
+    def add_items(self, items, clear=False):
+        """
+            Writes all of the items in a single transaction...
+        """
+        with self._transaction() as conn:
+            if clear:
+                conn.execute('DELETE FROM fridge')
+            conn.executemany('INSERT INTO fridge (name, unit, amount, expiry) VALUES (?, ?, ?, ?)',
+                             [(x.name, x.type, x.amount, x.expiry) for x in items])
+
+    def build_fridge_item(self, name, amt, food_type, expiry=None):
+        """
+            Parse the item exactly as the FoodList does, then store
+            it rather than appending to a list...
+        """
+        parsed = FoodList()
+        parsed.build_fridge_item(name, amt, food_type, expiry)
+        if parsed:
+            self.add_items(parsed)
+
+    def consume_item(self, name, amt, food_type, date=None):
+        """
+            Removes an amount of food from the fridge, using up the
+            stock closest to expiry first and stock with no expiry
+            last. Expired stock is never used. If there is not enough edible food nothing is
+            removed and an exception is raised...
+        """
+        if date is None:
+            date = datetime.date.today()
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT id, amount FROM fridge '
+                                'WHERE name = ? AND unit = ? AND (expiry IS NULL OR expiry >= ?) '
+                                'ORDER BY expiry IS NULL, expiry, id', (name, food_type, date)).fetchall()
+            if sum(amount for _, amount in rows) < amt:
+                raise Exception("Not enough {} {} in the fridge".format(food_type, name))
+            for row_id, amount in rows:
+                if amt <= 0:
+                    break
+                if amount <= amt:
+                    conn.execute('DELETE FROM fridge WHERE id = ?', (row_id,))
+                else:
+                    conn.execute('UPDATE fridge SET amount = ? WHERE id = ?', (amount - amt, row_id))
+                amt -= amount
+
+    def todays_food(self, date=None):
+        """
+            The database does the work here: drop anything past its
+            expiry, then sum the remaining stock of each item keeping
+            the earliest expiry. Stock with no expiry never goes off,
+            and MIN skips it unless that is all there is. The date
+            defaults to today...
+        """
+        if date is None:
+            date = datetime.date.today()
+        rows = self._query('SELECT SUM(amount), unit, name, MIN(expiry) AS "expiry [date]" '
+                           'FROM fridge WHERE expiry IS NULL OR expiry >= ? '
+                           'GROUP BY name, unit ORDER BY name, unit', (date,))
+        food = FoodList()
+        food.items = [FoodItem(*row) for row in rows]
+        return food
+
+    def import_csv(self, filename, clear=True):
+        """
+            Loads a fridge CSV file into the database, parsed the
+            same way as FoodList.read_csv...
+        """
+        parsed = FoodList()
+        parsed.read_csv(filename)
+        self.add_items(parsed, clear)
+
+    def export_csv(self, filename):
+        """
+            Writes the fridge back out in the CSV format it was read in...
+        """
+        with open(filename, 'wb') as f:
+            fridge_writer = csv.writer(f, delimiter=',')
+            for item in self:
+                expiry = item.expiry.strftime('%d/%m/%Y') if item.expiry else ''
+                fridge_writer.writerow([item.name, item.amount, item.type, expiry])
+
 class RecipeItem(object):
     """
         RecipeItem is a simple data structure to store
@@ -189,9 +381,10 @@ class RecipeBuilder(object):
         performs the main function of sorting and selecting recipes based
         on the fridge contents...
     """
-    def __init__(self):
-        # list of food items with expiry...
-        self.fridge = FoodList()
+    def __init__(self, fridge=None):
+        # list of food items with expiry, a FoodList unless
+        # another storage backend is given...
+        self.fridge = fridge if fridge is not None else FoodList()
         # list of RecipeItems...
         self.recipes = []
         # calculated RecipeItem()
@@ -226,17 +419,22 @@ class RecipeBuilder(object):
             print "Optimal recipe is:"
             print self.todays.name
 
-    def to_json(self):
+    def to_json(self, date=None):
         """
             This function will build a dictionary for use when
             passing the data over AJAX back to the web front-end.
             This will format the data to make it a little easier
-            for the front end to deal with...
+            for the front end to deal with. The days left are
+            counted from the date, which defaults to today...
         """
+        if date is None:
+            date = datetime.date.today()
         def item_string(item):
             return "{} {} {}".format(item.amount, item.type, item.name)
         def expiry_string(off_date):
-            time = (off_date - datetime.date.today()).days
+            if off_date is None:
+                return "no expiry"
+            time = (off_date - date).days
             if time == 1:
                 return "1 day left"
             else:
@@ -269,23 +467,23 @@ class RecipeBuilder(object):
             Here we construct the fridge object 
             from a well-formed csv file. If the line
             cannot be parsed, the line is simply skipped.
+            This includes blank or short lines.
 
             Format expected in the csv file is: [name],[amount],[type],[date]. e.g.
 
             cheese,10,slices,26/12/2014
+
+            The lines are parsed first and then handed to the fridge
+            in one go, so a database backed fridge is written once...
         """
-        if clear:
-            self.fridge = FoodList()
+        parsed = FoodList()
         # load up the fridge...
         try:
-            f = open(filename, 'rb')
-            fridge_reader = csv.reader(f, delimiter=',')
-            for line in fridge_reader:
-                # unpack the string and add to the fridge data structure...
-                self.fridge.build_fridge_item(*line)
+            parsed.read_csv(filename)
         except Exception as e:
             print "Failed to read fridge file {}.".format(filename)
             print e
+        self.fridge.add_items(parsed, clear)
         return self.fridge
 
     def build_recipes(self, filename=None, clear=True):
@@ -363,20 +561,24 @@ class RecipeBuilder(object):
                 # if it does exist, add to the expiry date...
                 dates.append(item.expiry)
         if found:
-            return min(dates)
+            # food with no expiry can be cooked any time...
+            dates = [x for x in dates if x is not None]
+            return min(dates) if dates else datetime.date.max
         else:
             return None
 
-    def todays_recipe(self):
+    def todays_recipe(self, date=None):
         """ 
             Grab today's food and look through the recipes.
             If it is possible to build the recipe with today's 
             ingredients, then add it to a list with the nearest
             expiry date as the key. From these recipes, we can 
             then return the nearest recipe based on the expiry.
+            The date defaults to today, but any other day can be
+            used to see what the recipe would be then.
         """
         # first we find all of the available food
-        all_list = self.fridge.todays_food()
+        all_list = self.fridge.todays_food(date)
         # We can now calculate recipes...
         recipe_list = []
         # run through all the recipes and see what can be built...
@@ -397,6 +599,79 @@ class RecipeBuilder(object):
             self.todays = recipe_obj[1]
         return self.todays
 
+    def recipe_timeline(self, start=None, end=None, top=1):
+        """
+            Finds the best recipes for every day from start to end
+            inclusive, as todays_recipe would for each date. Returns
+            a list of (date, recipes) with up to top RecipeItems per
+            day, best first. An empty list means order takeout.
+
+            Rather than recalculating every day, we sweep over the
+            expiry events. The food only changes on the day after
+            something expires, and then only for that item's name, so
+            only the recipes using that name get a new cooking date.
+            The ranking is then only redone on days with an event...
+        """
+        if start is None:
+            start = datetime.date.today()
+        if end is None:
+            end = start
+        one_day = datetime.timedelta(days=1)
+        # stock for each name in expiry order, skipping anything
+        # already gone at the start. Stock with no expiry never goes
+        # off, so it sits at the back and never makes an event...
+        stock = collections.defaultdict(collections.deque)
+        for item in sorted(self.fridge, key=FoodItem.expiry_key):
+            if item.edible(start):
+                stock[item.name].append(item)
+        # the names that change on each day...
+        events = collections.defaultdict(set)
+        for name, items in stock.iteritems():
+            for item in items:
+                if item.expiry is not None and item.expiry < end:
+                    events[item.expiry + one_day].add(name)
+        # recipes depending on each name...
+        users = collections.defaultdict(set)
+        for index, recipe in enumerate(self.recipes):
+            for item in recipe.ingredients:
+                users[item.name].add(index)
+        food = {}
+        def compact(name, date):
+            # drop the expired stock from the front of the list...
+            items = stock[name]
+            while items and not items[0].edible(date):
+                items.popleft()
+            food[name] = FoodList()._compact_food_list(items)
+        def cooking_date(index):
+            ingredients = self.recipes[index].ingredients
+            food_list = []
+            for name in set(x.name for x in ingredients):
+                food_list.extend(food.get(name, []))
+            return self._get_cooking_date(ingredients, food_list)
+        # start off with everything...
+        for name in stock:
+            compact(name, start)
+        dates = [cooking_date(index) for index in xrange(len(self.recipes))]
+        timeline = []
+        best = None
+        day = start
+        while day <= end:
+            changed = events.get(day)
+            if changed:
+                affected = set()
+                for name in changed:
+                    compact(name, day)
+                    affected.update(users[name])
+                for index in affected:
+                    dates[index] = cooking_date(index)
+            if changed or best is None:
+                # earliest cooking date first, ties in recipe order...
+                best = [self.recipes[index] for date, index in heapq.nsmallest(
+                            top, ((date, index) for index, date in enumerate(dates) if date))]
+            timeline.append((day, best))
+            day += one_day
+        return timeline
+
 """
 ===============
 
@@ -466,6 +741,113 @@ class TestFoodList(unittest.TestCase):
         today = self.t.todays_food()
         self.assertEqual(len(today), 0)
 
+class TestSQLiteFoodList(unittest.TestCase):
+    """
+        Unit tests for the SQLite backed food list. Each test gets
+        a fresh database in a temporary directory.
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.t = SQLiteFoodList(os.path.join(self.tmp, 'fridge.db'))
+        self.today = datetime.date.today()
+        self.later = (self.today + datetime.timedelta(days=3)).strftime('%d/%m/%Y')
+        self.soon = (self.today + datetime.timedelta(days=1)).strftime('%d/%m/%Y')
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    def test_build_fridge_item(self):
+        # items are stored and read back the same as a FoodList...
+        self.t.build_fridge_item('pickles', 2, 'of', '24/12/2012')
+        self.t.build_fridge_item('pickles', 20, 'grams', '24/12/2012')
+        self.assertEqual(len(self.t), 2)
+        self.assertEqual(self.t[1], FoodItem(20, 'grams', 'pickles', datetime.date(2012, 12, 24)))
+        # illegal items are not stored...
+        self.t.build_fridge_item('pickles', 2, 'blocks', '24/12/2012')
+        self.t.build_fridge_item('', 2, 'of', '24/12/2012')
+        self.assertEqual(len(self.t), 2)
+        # and the contents survive reopening the database...
+        reopened = SQLiteFoodList(self.t.filename)
+        self.assertEqual(reopened, self.t)
+        reopened.items = []
+        self.assertEqual(len(self.t), 0)
+    def test_todays_food(self):
+        self.t.build_fridge_item('pickles', 2, 'of', '24/12/2012')
+        self.t.build_fridge_item('cheese', 5, 'slices', self.later)
+        self.t.build_fridge_item('cheese', 3, 'slices', self.soon)
+        self.t.build_fridge_item('cheese', 100, 'grams', self.later)
+        today = self.t.todays_food()
+        self.assertEqual(len(today), 2)
+        self.assertEqual(today[0].name, 'cheese')
+        self.assertEqual(sorted((x.amount, x.type) for x in today), [(8, 'slices'), (100, 'grams')])
+        slices = [x for x in today if x.type == 'slices'][0]
+        self.assertEqual(slices.expiry, self.today + datetime.timedelta(days=1))
+    def test_consume_item(self):
+        self.t.build_fridge_item('cheese', 5, 'slices', self.later)
+        self.t.build_fridge_item('cheese', 3, 'slices', self.soon)
+        self.t.build_fridge_item('cheese', 9, 'slices', '24/12/2012')
+        # the soonest edible stock goes first...
+        self.t.consume_item('cheese', 4, 'slices')
+        self.assertEqual([x.amount for x in self.t], [4, 9])
+        # expired stock can't be used, and nothing is removed...
+        self.assertRaises(Exception, self.t.consume_item, 'cheese', 5, 'slices')
+        self.assertEqual([x.amount for x in self.t], [4, 9])
+        self.t.consume_item('cheese', 4, 'slices')
+        self.assertEqual([x.amount for x in self.t], [9])
+        # stock with no expiry is used last...
+        self.t.build_fridge_item('cheese', 2, 'slices')
+        self.t.build_fridge_item('cheese', 2, 'slices', self.soon)
+        self.t.consume_item('cheese', 3, 'slices')
+        self.assertEqual([(x.amount, x.expiry) for x in self.t], [(9, datetime.date(2012, 12, 24)), (1, None)])
+    def test_csv(self):
+        # import the default vector, export it and read it back...
+        self.t.import_csv('./test/vectors/fridge-default.csv')
+        self.assertEqual(len(self.t), 8)
+        exported = os.path.join(self.tmp, 'fridge.csv')
+        self.t.export_csv(exported)
+        rb = RecipeBuilder()
+        rb.build_fridge(exported)
+        self.assertEqual(rb.fridge, self.t)
+        # a RecipeBuilder can use the database directly...
+        rb = RecipeBuilder(self.t)
+        rb.build_all('./test/vectors/fridge-garlic-snails.csv', 'junk')
+        self.assertEqual(len(self.t), 2)
+        # blank and short lines are skipped rather than stopping the import...
+        messy = os.path.join(self.tmp, 'messy.csv')
+        with open(messy, 'wb') as f:
+            f.write('cheese,10,slices,{}\n\nbread,10\nbread,4,slices,{}\n'.format(self.later, self.soon))
+        self.t.import_csv(messy)
+        self.assertEqual([(x.name, x.amount) for x in self.t], [('cheese', 10), ('bread', 4)])
+        rb = RecipeBuilder()
+        rb.build_fridge(messy)
+        self.assertEqual(rb.fridge, self.t)
+    def test_matches_food_list(self):
+        # the same fridge gives the same food and recipes in both backends,
+        # including a name stocked in mixed units...
+        between = (self.today + datetime.timedelta(days=2)).strftime('%d/%m/%Y')
+        food = FoodList()
+        for line in [('cheese', 4, 'slices'), ('salt', 50, 'grams'),('cheese', 5, 'slices', self.later), ('cheese', 100, 'grams', between),
+                     ('cheese', 3, 'slices', self.soon), ('bread', 4, 'slices', self.later),
+                     ('bread', 2, 'slices', '24/12/2012')]:
+            food.build_fridge_item(*line)
+            self.t.build_fridge_item(*line)
+        self.assertEqual(self.t.todays_food(), food.todays_food())
+        self.assertEqual(len(food.todays_food()), 4)
+        # stock with no expiry never goes off, and doesn't hide the
+        # earliest expiry of the rest...
+        slices = [x for x in food.todays_food() if x.name == 'cheese' and x.type == 'slices'][0]
+        self.assertEqual((slices.amount, slices.expiry), (12, self.today + datetime.timedelta(days=1)))
+        far = datetime.date(2100, 1, 1)
+        self.assertEqual(self.t.todays_food(far), food.todays_food(far))
+        self.assertEqual([(x.name, x.amount) for x in food.todays_food(far)], [('cheese', 4), ('salt', 50)])
+        rb = RecipeBuilder(self.t)
+        self.assertEqual(rb.to_json()['fridge'][0]['expiry'], 'no expiry')
+        for fridge_file in ['fridge-default.csv', 'fridge-cheese.csv', 'fridge-garlic-snails.csv']:
+            for day in [datetime.date(2012, 12, 20), datetime.date(2013, 6, 1), datetime.date(2014, 12, 24)]:
+                memory, database = RecipeBuilder(), RecipeBuilder(self.t)
+                for rb in [memory, database]:
+                    rb.build_all('./test/vectors/' + fridge_file, './test/vectors/recipe-default.json')
+                self.assertEqual(database.fridge.todays_food(day), memory.fridge.todays_food(day))
+                self.assertEqual(database.todays_recipe(day), memory.todays_recipe(day))
+
 class TestRecipeBuilder(unittest.TestCase):
     """
         UnitTest class for the RecipeBuilder. These can be executed 
@@ -537,6 +919,45 @@ class TestRecipeBuilder(unittest.TestCase):
         self.assertEqual(json_obj['recipes'], self.EMPTY_JSON_DICT['recipes'])
         self.assertEqual(len(json_obj['fridge']), 8)
 
+    def test_todays_recipe_date(self):
+        # the default example was salad sandwich during 2013...
+        self.rb.build_all('fridge-default.csv', 'recipe-default.json')
+        self.assertEqual(self.rb.todays_recipe(datetime.date(2013, 6, 1)).name, 'salad sandwich')
+        self.assertEqual(self.rb.todays_recipe(datetime.date(2014, 12, 26)).name, 'grilled cheese on toast')
+        self.assertEqual(self.rb.todays_recipe(datetime.date(2014, 12, 27)).name, 'Order Takeout')
+        # asking again gives the same answer, nothing is used up...
+        self.assertEqual(self.rb.todays_recipe(datetime.date(2013, 6, 1)).name, 'salad sandwich')
+        json_obj = self.rb.to_json(datetime.date(2014, 12, 25))
+        self.assertEqual(json_obj['fridge'][2]['expiry'], '0 days left')
+        self.assertEqual(json_obj['fridge'][3]['expiry'], '2 days left')
+
+    def test_recipe_timeline(self):
+        # the sweep must agree with asking for each day in turn...
+        # with either fridge backend...
+        start, end = datetime.date(2012, 12, 18), datetime.date(2015, 1, 2)
+        tmp = tempfile.mkdtemp()
+        try:
+            for rb in [self.rb, RecipeBuilder(SQLiteFoodList(os.path.join(tmp, 'fridge.db')))]:
+                for fridge_file, recipe_file in [('fridge-default.csv', 'recipe-default.json'),
+                                                 ('fridge-cheese.csv', 'recipe-default.json'),
+                                                 ('fridge-mixed.csv', 'recipe-default.json'),
+                                                 ('fridge-no-expiry.csv', 'recipe-default.json'),
+                                                 ('fridge-garlic-snails.csv', 'recipe-no-match.json'),
+                                                 ('fridge-stale.csv', 'recipe-stale.json')]:
+                    rb.build_all(fridge_file, recipe_file)
+                    timeline = rb.recipe_timeline(start, end)
+                    self.assertEqual(len(timeline), (end - start).days + 1)
+                    for day, recipes in timeline:
+                        self.assertEqual(recipes[0].name if recipes else self.NO_RECIPE,
+                                         rb.todays_recipe(day).name)
+        finally:
+            shutil.rmtree(tmp)
+        # top recipes come earliest cooking date first...
+        self.rb.build_all('fridge-default.csv', 'recipe-default.json')
+        timeline = self.rb.recipe_timeline(datetime.date(2013, 6, 1), datetime.date(2013, 6, 2), top=2)
+        self.assertEqual([x.name for x in timeline[0][1]], ['salad sandwich', 'grilled cheese on toast'])
+        self.assertEqual(timeline[1][0], datetime.date(2013, 6, 2))
+
     def test_build_all(self):
         # missing files
         self.rb.build_all('junk', 'junk')
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+
+"""
+    Load Test
+    ====================
+    Load test harness for the run.py web server. A server is started
+    locally on a synthetic fridge and recipe book, and then driven by
+    a number of concurrent clients for a fixed time. Each client picks
+    requests from a weighted mix of:
+
+    data      -- GET data.json, the recipe and fridge reply
+    static    -- GET one of the static assets
+    fridge    -- multipart POST of a fridge CSV file
+    recipe    -- multipart POST of a recipe JSON file
+
+    The uploads post the synthetic files back again, so the workload
+    stays the same for the whole run. While running, the throughput,
+    errors and server memory are printed every interval. At the end
+    the throughput, p50/p95/p99 latency and error rate are reported
+    for each kind of request. e.g.
+
+    python loadtest.py --clients 32 --duration 30 --mix data=8,static=2,fridge=1 --workers 4
+
+    Server memory is read from /proc, so is only reported on Linux. RSS
+    counts the shared snapshot pages once per process, PSS shares them
+    out between the processes...
+"""
+
+import argparse
+import datetime
+import httplib
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import fridge
+
+# static assets served alongside the page...
+ASSETS = ['index.html', 'css', 'js', 'img']
+STATIC_PATHS = ['/index.html', '/css/style.css', '/js/fridge.js', '/js/jquery-1.10.2.min.js']
+UNITS = [fridge.FoodType.SINGLE, fridge.FoodType.GRAMS, fridge.FoodType.ML, fridge.FoodType.SLICES]
+BOUNDARY = 'loadtestboundary'
+
+def build_data(directory, items, recipes, foods, seed):
+    """
+        Writes a synthetic fridge CSV and recipe JSON file into the
+        directory. Expiry dates are spread either side of today so
+        some stock is stale, and recipes use 2-4 of the foods...
+    """
+    rand = random.Random(seed)
+    today = datetime.date.today()
+    names = ['food {}'.format(x) for x in xrange(foods)]
+    units = dict((name, rand.choice(UNITS)) for name in names)
+    fridge_file = os.path.join(directory, 'fridge.csv')
+    with open(fridge_file, 'wb') as f:
+        for i in xrange(items):
+            name = rand.choice(names)
+            expiry = today + datetime.timedelta(days=rand.randint(-5, 30))
+            f.write('{},{},{},{}\n'.format(name, rand.randint(1, 500), units[name],
+                                           expiry.strftime('%d/%m/%Y')))
+    recipe_file = os.path.join(directory, 'recipe.json')
+    with open(recipe_file, 'wb') as f:
+        json.dump([{
+                    'name': 'recipe {}'.format(i),
+                    'ingredients': [{
+                                    'item': name,
+                                    'amount': str(rand.randint(1, 50)),
+                                    'unit': units[name]
+                                    } for name in rand.sample(names, rand.randint(2, min(4, foods)))]
+                    } for i in xrange(recipes)], f)
+    return fridge_file, recipe_file
+
+def multipart(field, filename):
+    """
+        Builds the form data body for an upload, as sent by the page...
+    """
+    with open(filename, 'rb') as f:
+        content = f.read()
+    body = '\r\n'.join([
+            '--' + BOUNDARY,
+            'Content-Disposition: form-data; name="{}"; filename="{}"'.format(field, os.path.basename(filename)),
+            'Content-Type: application/octet-stream',
+            '',
+            content,
+            '--' + BOUNDARY + '--',
+            ''])
+    return body, {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY}
+
+class Server(object):
+    """
+        Runs run.py in a scratch directory holding the static assets,
+        so uploads don't overwrite anything in the source tree...
+    """
+    def __init__(self, directory, port, fridge_file, recipe_file, workers=0, db=None):
+        self.directory = directory
+        self.port = port
+        here = os.path.dirname(os.path.abspath(__file__))
+        for asset in ASSETS:
+            os.symlink(os.path.join(here, asset), os.path.join(directory, asset))
+        os.mkdir(os.path.join(directory, 'data'))
+        cmd = [sys.executable, os.path.join(here, 'run.py'),
+               '--fridge', fridge_file, '--recipes', recipe_file,
+               '--host', '127.0.0.1', '--port', str(port)]
+        if workers:
+            cmd += ['--workers', str(workers)]
+        if db:
+            cmd += ['--db', os.path.join(directory, db)]
+        # the server prints every reply, so keep it out of the report...
+        self.log = open(os.path.join(directory, 'server.log'), 'wb')
+        self.process = subprocess.Popen(cmd, cwd=directory, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait(self, timeout=10.0):
+        """
+            Waits for the server to accept connections...
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise Exception('Server exited, see {}'.format(self.log.name))
+            try:
+                socket.create_connection(('127.0.0.1', self.port), 0.5).close()
+                return
+            except socket.error:
+                time.sleep(0.1)
+        raise Exception('Server did not start within {} seconds'.format(timeout))
+
+    def pids(self):
+        """
+            The server process and any pre-forked workers...
+        """
+        pids = [self.process.pid]
+        try:
+            for pid in os.listdir('/proc'):
+                if pid.isdigit():
+                    with open('/proc/{}/stat'.format(pid)) as f:
+                        # the ppid follows the bracketed command name...
+                        if int(f.read().rsplit(')', 1)[1].split()[1]) == self.process.pid:
+                            pids.append(int(pid))
+        except (IOError, OSError, IndexError, ValueError):
+            pass
+        return pids
+
+    def memory(self):
+        """
+            Returns the summed (rss, pss) of the server in kB, or None
+            for anything /proc can't tell us...
+        """
+        def read_kb(filename, key):
+            try:
+                with open(filename) as f:
+                    for line in f:
+                        if line.startswith(key + ':'):
+                            return int(line.split()[1])
+            except (IOError, OSError):
+                pass
+            return None
+        totals = []
+        for filename, key in [('status', 'VmRSS'), ('smaps_rollup', 'Pss')]:
+            values = [read_kb('/proc/{}/{}'.format(pid, filename), key) for pid in self.pids()]
+            totals.append(sum(values) if None not in values else None)
+        return tuple(totals)
+
+    def stop(self):
+        # a TERM also stops the workers of a pre-forked server...
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.log.close()
+
+class Client(threading.Thread):
+    """
+        A single client, making one request at a time on a new
+        connection until told to stop. Results are recorded as
+        (kind, latency, ok, start time) tuples...
+    """
+    def __init__(self, port, requests, weights, stop, seed):
+        super(Client, self).__init__()
+        self.daemon = True
+        self.port = port
+        self.requests = requests
+        self.weights = weights
+        self.stop = stop
+        self.rand = random.Random(seed)
+        self.results = []
+
+    def choose(self):
+        x = self.rand.uniform(0, sum(self.weights))
+        for kind, weight in zip(self.requests, self.weights):
+            x -= weight
+            if x <= 0:
+                return kind
+        return self.requests[-1]
+
+    def run(self):
+        while not self.stop.is_set():
+            kind, method, path, body, headers = self.choose()
+            start = time.time()
+            try:
+                conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=30)
+                conn.request(method, path(self.rand) if callable(path) else path, body, headers)
+                reply = conn.getresponse()
+                reply.read()
+                conn.close()
+                ok = reply.status == 200
+            except (socket.error, httplib.HTTPException):
+                ok = False
+            self.results.append((kind, time.time() - start, ok, start))
+
+def percentile(values, p):
+    """
+        Nearest rank percentile of a sorted list...
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+def report(results, elapsed, kinds):
+    """
+        Prints the summary table, one row per kind of request...
+    """
+    print
+    print '{:<8} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+            'request', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors')
+    for kind in kinds + ['total']:
+        rows = [x for x in results if kind == 'total' or x[0] == kind]
+        latencies = sorted(x[1] * 1000 for x in rows)
+        errors = sum(1 for x in rows if not x[2])
+        print '{:<8} {:>8} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7.2f}%'.format(
+                kind, len(rows), len(rows) / elapsed,
+                percentile(latencies, 0.50), percentile(latencies, 0.95), percentile(latencies, 0.99),
+                100.0 * errors / len(rows) if rows else 0.0)
+
+def parse_mix(mix):
+    """
+        Parses the mix string, e.g. data=8,static=2,fridge=1...
+    """
+    weights = {}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        weights[kind.strip()] = float(weight)
+    return weights
+
+def main():
+    weights = parse_mix(args.mix)
+    directory = tempfile.mkdtemp(prefix='loadtest-')
+    server = None
+    try:
+        fridge_file, recipe_file = build_data(directory, args.items, args.recipe_count, args.foods, args.seed)
+        fridge_body, fridge_headers = multipart('fridge-upload', fridge_file)
+        recipe_body, recipe_headers = multipart('recipe-upload', recipe_file)
+        available = {
+            'data': ('data', 'GET', '/data.json', None, {}),
+            'static': ('static', 'GET', lambda rand: rand.choice(STATIC_PATHS), None, {}),
+            'fridge': ('fridge', 'POST', '/', fridge_body, fridge_headers),
+            'recipe': ('recipe', 'POST', '/', recipe_body, recipe_headers),
+        }
+        for kind in weights:
+            if kind not in available:
+                raise Exception('Unknown request type {}, expected one of {}'.format(kind, ', '.join(sorted(available))))
+        kinds = [x for x in ['data', 'static', 'fridge', 'recipe'] if weights.get(x)]
+        requests = [available[x] for x in kinds]
+        # start the server...
+        server = Server(directory, args.port, fridge_file, recipe_file, args.workers, args.db)
+        server.wait()
+        print 'Server started with {} fridge items and {} recipes, {} workers.'.format(
+                args.items, args.recipe_count, args.workers or 'no')
+        # and the clients...
+        stop = threading.Event()
+        clients = [Client(args.port, requests, [weights[x] for x in kinds], stop, args.seed + i)
+                   for i in xrange(args.clients)]
+        start = time.time()
+        for client in clients:
+            client.start()
+        print '{:>8} {:>9} {:>8} {:>10} {:>10}'.format('time s', 'req/s', 'errors', 'rss kB', 'pss kB')
+        seen, last = dict((client, 0) for client in clients), start
+        while time.time() - start < args.duration:
+            time.sleep(min(args.interval, max(0, args.duration - (time.time() - start))))
+            now = time.time()
+            # each client's list only grows, so take what's new in each...
+            new = []
+            for client in clients:
+                results = client.results[seen[client]:]
+                seen[client] += len(results)
+                new.extend(results)
+            rss, pss = server.memory()
+            print '{:>8.1f} {:>9.1f} {:>8} {:>10} {:>10}'.format(
+                    now - start, len(new) / max(now - last, 1e-6),
+                    sum(1 for x in new if not x[2]), rss or '-', pss or '-')
+            last = now
+        stop.set()
+        stopped = time.time()
+        for client in clients:
+            client.join()
+        # only count requests started within the run, however long
+        # the last ones took to finish...
+        report([x for client in clients for x in client.results if x[3] < stopped],
+               stopped - start, kinds)
+    finally:
+        if server:
+            server.stop()
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    """
+        The workload is fixed by the arguments and the seed, so runs can
+        be compared before and after a change to the server...
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", nargs='?', type=int, help="server port", default=8123)
+    parser.add_argument("-c", "--clients", nargs='?', type=int, help="concurrent clients", default=16)
+    parser.add_argument("-t", "--duration", nargs='?', type=float, help="seconds to run for", default=10.0)
+    parser.add_argument("-i", "--interval", nargs='?', type=float, help="seconds between progress lines", default=1.0)
+    parser.add_argument("-m", "--mix", nargs='?', help="weighted request mix", default="data=8,static=2,fridge=1,recipe=1")
+    parser.add_argument("-w", "--workers", nargs='?', type=int, help="pre-forked server processes", default=0)
+    parser.add_argument("-d", "--db", nargs='?', help="keep the server fridge in this SQLite file")
+    parser.add_argument("--items", nargs='?', type=int, help="synthetic fridge items", default=200)
+    parser.add_argument("--recipe-count", nargs='?', type=int, help="synthetic recipes", default=50)
+    parser.add_argument("--foods", nargs='?', type=int, help="distinct synthetic foods", default=40)
+    parser.add_argument("--seed", nargs='?', type=int, help="random seed", default=1)
+    args = parser.parse_args()
+    main()
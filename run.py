@@ -13,12 +13,28 @@
     launch a simple web server to display the results in a web page.
     Alternatively, the user can simply run the script from the cmd
     line.
+
+    For multi-core boxes the server can also be pre-forked. The parent
+    process keeps the RecipeBuilder and writes the data.json reply into
+    a snapshot file. The workers share the listening socket and serve
+    data.json straight from a read-only memory map of that file...
 """
 
 import fridge
 import argparse
 import json
 import cgi
+import datetime
+import errno
+import os
+import mmap
+import time
+import signal
+import tempfile
+import threading
+import collections
+import shutil
+import unittest
 import BaseHTTPServer
 import SimpleHTTPServer
 import SocketServer
@@ -29,6 +45,75 @@ import SocketServer
 """
 rb = fridge.RecipeBuilder()
 
+"""
+    Global snapshot, only used by the workers of a pre-forked server...
+"""
+snapshot = None
+
+class SnapshotMap(collections.namedtuple('SnapshotMap', 'version data offset uploads')):
+    """
+        One mapped snapshot file. It is never changed once built, so
+        a thread holding one always sees a map with its own offset
+        and uploads...
+    """
+    def reply(self):
+        """
+            The data.json reply, without copying it out of the map...
+        """
+        return buffer(self.data, self.offset)
+
+class Snapshot(object):
+    """
+        Read-only memory map of the data.json reply. The parent writes
+        a new file and renames it over the old one, so a worker only
+        needs to stat the file to notice and remap. Old maps are left
+        for the garbage collector, as another thread may still be
+        sending from one.
+
+        The first line of the file records the version of each upload
+        the reply was built from, so a worker can wait for its own...
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.current = None
+        # the worker threads share the snapshot...
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_version(filename):
+        """
+            Identifies one particular upload of a file...
+        """
+        st = os.stat(filename)
+        return [st.st_ino, st.st_mtime, st.st_size]
+
+    @staticmethod
+    def write(filename, builder, uploads=None):
+        """
+            Builds the reply and atomically swaps it into place...
+        """
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(uploads or {}) + '\n')
+            json.dump(builder.to_json(), f)
+        os.rename(tmp, filename)
+
+    def refresh(self):
+        """
+            Remaps the snapshot if it has been replaced, and returns
+            the current SnapshotMap. The lock stops two threads from
+            remapping at once and leaving the older map in place...
+        """
+        with self.lock:
+            st = os.stat(self.filename)
+            version = (st.st_ino, st.st_mtime, st.st_size)
+            if self.current is None or version != self.current.version:
+                with open(self.filename, 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                offset = data.find('\n') + 1
+                self.current = SnapshotMap(version, data, offset, json.loads(data[:offset]))
+            return self.current
+
 class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
     """
         This is the basic web response handler. This object
@@ -36,12 +121,10 @@ class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
         conversion function to pretty up the food item format
         for the front page...
     """
-    def __init__(self, *arg, **kwargs):
-        # constants...
-        self.DATA_FILENAME = 'data.json'
-        self.FRIDGE_FILE = 'data/fridge.csv'
-        self.RECIPE_FILE = 'data/recipe.json'
-        super(Handler, self).__init__(*arg, **kwargs)
+    # constants...
+    DATA_FILENAME = 'data.json'
+    FRIDGE_FILE = 'data/fridge.csv'
+    RECIPE_FILE = 'data/recipe.json'
 
     def do_GET(self):
         """
@@ -86,12 +169,7 @@ class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
             This function loads the file from the web front end and
             saves it. Response is then constructed
         """         
-        try:
-            f = open(filename, 'wb')
-            f.write(filedata)
-            f.close()
-        except:
-            raise Exception('Failed to open storage file.')
+        self.store_content(filename, filedata)
         try:
             fn(filename)
             rb.todays_recipe()
@@ -100,6 +178,22 @@ class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
             raise Exception('Failed to rebuild recipe')
         self.food_response()
 
+    def store_content(self, filename, filedata):
+        """
+            Saves the uploaded file. It is written alongside and renamed
+            into place, so nothing ever reads a half written upload.
+            Returns the version of the file stored...
+        """
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(filedata)
+            version = Snapshot.file_version(tmp)
+            os.rename(tmp, filename)
+        except:
+            raise Exception('Failed to open storage file.')
+        return version
+
     def food_response(self, code=200):
         """
             Here we build the http response for the server...
@@ -126,6 +220,159 @@ class Handler(SimpleHTTPServer.SimpleHTTPRequestHandler, object):
         self.send_header('Content-Type', mime_t)
         self.end_headers()
 
+class PreforkHandler(Handler):
+    """
+        Handler for the workers of a pre-forked server. The data.json
+        reply is sent from the shared snapshot rather than rebuilt, and
+        uploads are saved and then handed to the parent to rebuild...
+    """
+    # parent process to signal, set before forking...
+    PARENT = None
+    SIGNALS = {
+        Handler.FRIDGE_FILE: signal.SIGUSR1,
+        Handler.RECIPE_FILE: signal.SIGUSR2,
+    }
+    REBUILD_TIMEOUT = 5.0
+
+    def prepare_content(self, filename, filedata, fn):
+        """
+            Save the file and ask the parent for a new snapshot, then
+            wait for one built from this upload before replying. If
+            another upload replaces the file before the parent reads
+            it, we wait for that one instead, as it is what the parent
+            will read...
+        """
+        version = self.store_content(filename, filedata)
+        os.kill(self.PARENT, self.SIGNALS[filename])
+        deadline = time.time() + self.REBUILD_TIMEOUT
+        while True:
+            if snapshot.refresh().uploads.get(filename) == version:
+                break
+            current = Snapshot.file_version(filename)
+            if current != version:
+                version = current
+            if time.time() > deadline:
+                raise Exception('Failed to rebuild recipe')
+            time.sleep(0.01)
+        self.food_response()
+
+    def food_response(self, code=200):
+        """
+            Sends the snapshot straight from the memory map...
+        """
+        try:
+            data = snapshot.refresh().reply()
+        except Exception as e:
+            print e
+            self.response(500)
+            print >> self.wfile, 'Get request failed:', e
+            return
+        self.response(code, "application/json")
+        self.wfile.flush()
+        self.connection.sendall(data)
+
+def make_parent_dir(filename):
+    """
+        Creates the directory a file goes in, e.g. data/ which is not
+        in a fresh checkout...
+    """
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+def prefork(server, workers, snapshot_file):
+    """
+        Forks the workers to share the server socket, then waits in the
+        parent to rebuild the snapshot whenever a worker signals that a
+        file has been uploaded, and when the date changes. The signal
+        handler only queues the rebuild, which is done from the main
+        loop. Each upload is linked to a private name before it is
+        read, so we know exactly which upload went into the snapshot...
+    """
+    global snapshot
+    make_parent_dir(snapshot_file)
+    uploads = {}
+    Snapshot.write(snapshot_file, rb, uploads)
+    built_on = datetime.date.today()
+    PreforkHandler.PARENT = os.getpid()
+    server.RequestHandlerClass = PreforkHandler
+    pending = set()
+    builders = {
+        signal.SIGUSR1: (Handler.FRIDGE_FILE, rb.build_fridge),
+        signal.SIGUSR2: (Handler.RECIPE_FILE, rb.build_recipes),
+    }
+    def read_upload(filename, build):
+        private = '{}.{}.read'.format(filename, os.getpid())
+        if os.path.exists(private):
+            os.remove(private)
+        # the link fails if a worker renames a newer upload over the
+        # file as we link it, so try again to get the newer one...
+        for attempt in xrange(10):
+            try:
+                os.link(filename, private)
+                break
+            except OSError as e:
+                if e.errno != errno.ENOENT or attempt == 9:
+                    raise
+        try:
+            build(private)
+            return Snapshot.file_version(private)
+        finally:
+            os.remove(private)
+    def queue_rebuild(signum, frame):
+        pending.add(signum)
+    # install before forking, the default action would kill the parent...
+    for signum in builders:
+        signal.signal(signum, queue_rebuild)
+    # start up the workers...
+    children = []
+    for i in xrange(workers):
+        pid = os.fork()
+        if pid == 0:
+            snapshot = Snapshot(snapshot_file)
+            snapshot.refresh()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            os._exit(0)
+        children.append(pid)
+    print('Started {} workers.'.format(workers))
+    # stop the workers on a kill as well as a ctrl-c...
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            # the days left and the recipe change at midnight too, so
+            # rebuild then as well as after an upload...
+            today = datetime.date.today()
+            if pending or today != built_on:
+                built_on = today
+                try:
+                    read = {}
+                    while pending:
+                        filename, build = builders[pending.pop()]
+                        read[filename] = read_upload(filename, build)
+                    rb.todays_recipe()
+                    latest = dict(uploads)
+                    latest.update(read)
+                    Snapshot.write(snapshot_file, rb, latest)
+                    uploads.update(read)
+                except Exception as e:
+                    # keep serving the last good snapshot, the worker
+                    # waiting on the upload will time out with a 500...
+                    print "Failed to rebuild snapshot: {}".format(e)
+            # a signal cuts the sleep short...
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
 def main():
     """
         For the main function we have two options, we are either serving
@@ -133,26 +380,117 @@ def main():
         The host argument is used to determine which has been requested 
         from the user.
     """
-    # construct the initial object...
-    rb.build_all(args.fridge, args.recipes)
+    # construct the initial object. With a database the fridge is
+    # only reloaded when a fridge file is given, so it persists...
+    if args.db:
+        make_parent_dir(args.db)
+        rb.fridge = fridge.SQLiteFoodList(args.db)
+    if args.fridge or not args.db:
+        rb.build_fridge(args.fridge)
+    rb.build_recipes(args.recipes)
+    rb.todays_recipe()
     # now we split based on the host or simple command line app...
     if args.host:
         # This is the server option. Here the results can be viewed on the
         # host:port specified at the cmd line...
         print('Attempting to open socket at {}:{}'.format(args.host, args.port))
+        # somewhere to keep the uploads...
+        make_parent_dir(Handler.FRIDGE_FILE)
         # first open the HTTP to handle JSON requests and serve forever...
         s = SocketServer.ThreadingTCPServer((args.host, args.port), Handler)
         if not s:
             print("Failed to initialize server.")
             return
         else:
+            if args.workers:
+                prefork(s, args.workers, args.snapshot)
+                return
             try:
                 s.serve_forever()
             except KeyboardInterrupt:
                 pass 
     else:
-        # grab today's recipe...
+        # grab today's recipe, or the recipe as of the date given...
+        if args.date:
+            rb.todays_recipe(args.date)
         rb.print_debug_info()
+        if args.days:
+            print
+            print "===RECIPE TIMELINE==="
+            for day, recipes in rb.recipe_timeline(args.date, (args.date or datetime.date.today()) + datetime.timedelta(days=args.days - 1)):
+                print "{}: {}".format(day, recipes[0].name if recipes else fridge.RecipeItem().name)
+
+"""
+===============
+
+ UNIT TESTS for the pre-forked server's snapshot...
+
+===============
+"""
+
+class TestSnapshot(unittest.TestCase):
+    """
+        Unit tests for the snapshot shared by the workers. These can be
+        executed from the command line with:
+
+        python -m unittest -v -b run
+    """
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp, 'snapshot.json')
+        self.rb = fridge.RecipeBuilder()
+        self.rb.build_all('./test/vectors/fridge-default.csv', './test/vectors/recipe-default.json')
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+    def test_reply(self):
+        # the reply skips the uploads line and is the data.json reply...
+        Snapshot.write(self.filename, self.rb)
+        current = Snapshot(self.filename).refresh()
+        self.assertEqual(current.uploads, {})
+        self.assertEqual(json.loads(str(current.reply())), json.loads(json.dumps(self.rb.to_json())))
+    def test_uploads(self):
+        # the upload versions survive the trip through the file...
+        upload = os.path.join(self.tmp, 'fridge.csv')
+        shutil.copy('./test/vectors/fridge-cheese.csv', upload)
+        uploads = {Handler.FRIDGE_FILE: Snapshot.file_version(upload)}
+        Snapshot.write(self.filename, self.rb, uploads)
+        current = Snapshot(self.filename).refresh()
+        self.assertEqual(current.uploads, uploads)
+        self.assertEqual(current.uploads[Handler.FRIDGE_FILE], Snapshot.file_version(upload))
+    def test_rewrite(self):
+        # a rewrite is picked up, and the old map is left as it was...
+        snapshot = Snapshot(self.filename)
+        Snapshot.write(self.filename, self.rb)
+        old = snapshot.refresh()
+        old_reply = str(old.reply())
+        self.assertIs(snapshot.refresh(), old)
+        self.rb.build_fridge('./test/vectors/fridge-garlic-snails.csv')
+        Snapshot.write(self.filename, self.rb, {'x': [1, 2.5, 3]})
+        new = snapshot.refresh()
+        self.assertIsNot(new, old)
+        self.assertEqual(len(json.loads(str(new.reply()))['fridge']), 2)
+        self.assertEqual(new.uploads, {'x': [1, 2.5, 3]})
+        self.assertEqual(str(old.reply()), old_reply)
+    def test_threads(self):
+        # replies read while the file is rewritten are always whole...
+        snapshot = Snapshot(self.filename)
+        Snapshot.write(self.filename, self.rb)
+        errors = []
+        def read():
+            for i in xrange(200):
+                try:
+                    json.loads(str(snapshot.refresh().reply()))
+                except Exception as e:
+                    errors.append(e)
+        threads = [threading.Thread(target=read) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for i in xrange(50):
+            # a growing uploads line moves the reply's offset each time...
+            Snapshot.write(self.filename, self.rb, {'x': range(i)})
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
 
 if __name__ == "__main__":
     """
@@ -164,5 +502,11 @@ if __name__ == "__main__":
     parser.add_argument("--port", nargs='?', type=int, help="server port", default=8000)
     parser.add_argument("-f", "--fridge", nargs='?', help="CSV file of fridge items")
     parser.add_argument("-r", "--recipes", nargs='?', help="JSON file of recipes")
+    parser.add_argument("-w", "--workers", nargs='?', type=int, help="number of pre-forked server processes", default=0)
+    parser.add_argument("--snapshot", nargs='?', help="snapshot file shared by the workers", default="data/snapshot.json")
+    parser.add_argument("--date", nargs='?', help="find the recipe as of this DD/MM/YYYY date",
+                        type=lambda x: datetime.datetime.strptime(x, '%d/%m/%Y').date())
+    parser.add_argument("--days", nargs='?', type=int, help="print the best recipe for this many days ahead")
+    parser.add_argument("-d", "--db", nargs='?', help="SQLite file to store the fridge in")
     args = parser.parse_args()
     main()
\ No newline at end of file